@@ -6,6 +6,7 @@ Script which helps to migrate Git repos from Bitbucket to Stash.
 Usage:
   bb2s [options] list bitbucket repos <bitbucket_prj>
   bb2s [options] list stash (projects|repos <stash_prj_key>)
+  bb2s [options] migrate --manifest=FILE
   bb2s [options] <bitbucket_prj> <bitbucket_repo> <stash_prj_name> \
 <stash_prj_key> [<stash_repo>]
   bb2s -h | --help
@@ -14,6 +15,8 @@ Usage:
 Options:
   -c FILE --config=FILE  Config file path [default: bb2s.ini].
   -k --keys              Handle SSH keys.
+  -l --lfs               Migrate Git LFS objects.
+  --manifest=FILE        Manifest file (CSV or YAML) with repo mappings.
   -q --quiet             Do not show any messages.
   -d --debug             Show debug messages.
   -h --help              Show this screen.
@@ -21,8 +24,15 @@ Options:
 '''
 
 from docopt import docopt
+from multiprocessing.pool import ThreadPool
 import ConfigParser
+import binascii
+import calendar
+import codecs
+import csv
+import errno
 import git
+import hashlib
 import json
 import logging
 import os
@@ -31,6 +41,12 @@ import requests
 import shutil
 import sys
 import tempfile
+import time
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
 
 
 class Bitbucket:
@@ -338,28 +354,470 @@ class Stash:
         return ret
 
 
+class GitLfs:
+    # Git LFS API:
+    # https://github.com/git-lfs/git-lfs/blob/master/docs/api/batch.md
+    # https://github.com/git-lfs/git-lfs/blob/master/docs/spec.md
+
+    cache_dir = ''
+    threads = 4
+    batch_size = 100
+    retries = 3
+    expiry_margin = 60
+    log = None
+    pointer_max_size = 1024
+    pointer_re = re.compile(
+        r'^version https://(git-lfs\.github\.com|hawser\.github\.com)/spec/v1'
+        r'\noid sha256:([0-9a-f]{64})\nsize ([0-9]+)\n')
+    media_type = 'application/vnd.git-lfs+json'
+
+    def __init__(self, cache_dir, logger, threads=4, batch_size=100):
+        self.cache_dir = cache_dir
+        self.log = logger
+        self.threads = threads
+        self.batch_size = batch_size
+
+        self.log.debug('Creating GitLfs object instance')
+
+    def get_pointer_list(self, repo):
+        self.log.debug('Getting list of all Git LFS pointers')
+
+        ret = {}
+        ret['list'] = []
+        ret['status'] = True
+        oids = set()
+
+        # All objects of a fresh clone are reachable from some ref so there
+        # is no need to walk the history of every ref separately
+        objects = repo.git.cat_file('--batch-all-objects', '--batch-check')
+
+        for line in objects.splitlines():
+            sha, obj_type, size = line.split()
+
+            if obj_type != 'blob' or int(size) > self.pointer_max_size:
+                continue
+
+            data = repo.odb.stream(binascii.unhexlify(sha)).read()
+            match = self.pointer_re.match(data)
+
+            if match and match.group(2) not in oids:
+                oids.add(match.group(2))
+                ret['list'].append({
+                    'oid': match.group(2),
+                    'size': int(match.group(3))
+                })
+
+        return ret
+
+    def get_cache_path(self, oid):
+        # Same layout as the .git/lfs/objects directory
+        return os.path.join(self.cache_dir, oid[0:2], oid[2:4], oid)
+
+    def is_cached(self, obj):
+        path = self.get_cache_path(obj['oid'])
+
+        return (
+            os.path.isfile(path) and
+            os.path.getsize(path) == obj['size'])
+
+    def batch(self, url, auth, operation, objects):
+        self.log.debug('Requesting Git LFS %s batch' % operation)
+
+        ret = {}
+        ret['list'] = []
+        ret['status'] = True
+
+        payload = {
+            'operation': operation,
+            'transfers': ['basic'],
+            'objects': [
+                {'oid': obj['oid'], 'size': obj['size']} for obj in objects]
+        }
+
+        try:
+            r = requests.post(
+                '%s/objects/batch' % url,
+                data=json.dumps(payload),
+                auth=auth,
+                headers={
+                    'Accept': self.media_type,
+                    'Content-type': self.media_type})
+        except requests.RequestException as e:
+            self.log.warning('Git LFS %s batch failed: %s' % (operation, e))
+            ret['status'] = False
+
+            return ret
+
+        if r.status_code == 200:
+            ret['list'] = r.json()['objects']
+
+            # Remember when the actions were issued to know when they expire
+            for obj in ret['list']:
+                obj['received'] = time.time()
+        else:
+            ret['status'] = False
+
+        return ret
+
+    def is_expired(self, obj, operation):
+        action = obj['actions'][operation]
+        deadline = None
+
+        if 'expires_in' in action:
+            deadline = obj['received'] + action['expires_in']
+        elif 'expires_at' in action:
+            try:
+                deadline = calendar.timegm(time.strptime(
+                    action['expires_at'][:19], '%Y-%m-%dT%H:%M:%S'))
+            except ValueError:
+                pass
+
+        return (
+            deadline is not None and
+            time.time() + self.expiry_margin > deadline)
+
+    def refresh(self, obj, url, auth, operation):
+        self.log.debug(
+            'Refreshing Git LFS %s action of object %s' %
+            (operation, obj['oid']))
+
+        obj_list = self.batch(url, auth, operation, [obj])
+
+        if obj_list['status']:
+            for new_obj in obj_list['list']:
+                if (
+                        new_obj['oid'] == obj['oid'] and
+                        operation in new_obj.get('actions', {})):
+                    return new_obj
+
+        return None
+
+    def download(self, obj):
+        self.log.debug('Downloading Git LFS object %s' % obj['oid'])
+
+        action = obj['actions']['download']
+        path = self.get_cache_path(obj['oid'])
+        obj_dir = os.path.dirname(path)
+        tmp_path = None
+
+        try:
+            if not os.path.isdir(obj_dir):
+                try:
+                    os.makedirs(obj_dir)
+                except OSError as e:
+                    # Another thread or process has just created it
+                    if e.errno != errno.EEXIST:
+                        raise
+
+            r = requests.get(
+                action['href'], headers=action.get('header', {}), stream=True)
+
+            try:
+                if r.status_code != 200:
+                    return False
+
+                # Download into a temporal file first so an interrupted
+                # transfer never ends up in the cache
+                fd, tmp_path = tempfile.mkstemp(dir=obj_dir)
+                sha = hashlib.sha256()
+                size = 0
+
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=1024*1024):
+                        sha.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+
+                if sha.hexdigest() != obj['oid'] or size != obj['size']:
+                    self.log.warning(
+                        'Git LFS object %s is corrupted' % obj['oid'])
+
+                    return False
+
+                os.rename(tmp_path, path)
+                tmp_path = None
+            finally:
+                r.close()
+        except (requests.RequestException, IOError, OSError) as e:
+            self.log.warning(
+                'Git LFS object %s download failed: %s' % (obj['oid'], e))
+
+            return False
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return True
+
+    def upload(self, obj, auth):
+        self.log.debug('Uploading Git LFS object %s' % obj['oid'])
+
+        action = obj['actions']['upload']
+
+        try:
+            with open(self.get_cache_path(obj['oid']), 'rb') as f:
+                r = requests.put(
+                    action['href'],
+                    data=f,
+                    headers=action.get('header', {}))
+
+            if r.status_code not in (200, 201):
+                return False
+
+            if 'verify' in obj['actions']:
+                action = obj['actions']['verify']
+                headers = {
+                    'Accept': self.media_type,
+                    'Content-type': self.media_type
+                }
+                headers.update(action.get('header', {}))
+
+                # Authorization from the action takes precedence
+                if 'Authorization' in headers:
+                    auth = None
+
+                r = requests.post(
+                    action['href'],
+                    data=json.dumps({'oid': obj['oid'], 'size': obj['size']}),
+                    auth=auth,
+                    headers=headers)
+
+                if r.status_code != 200:
+                    return False
+        except (requests.RequestException, IOError) as e:
+            self.log.warning(
+                'Git LFS object %s upload failed: %s' % (obj['oid'], e))
+
+            return False
+
+        return True
+
+    def retry(self, obj, url, auth, operation):
+        for attempt in range(self.retries):
+            # Get a fresh action if the old one expired or has already failed
+            if attempt > 0 or self.is_expired(obj, operation):
+                new_obj = self.refresh(obj, url, auth, operation)
+
+                if new_obj is None:
+                    continue
+
+                obj = new_obj
+
+            if operation == 'download':
+                success = self.download(obj)
+            else:
+                success = self.upload(obj, auth)
+
+            if success:
+                return True
+
+        return False
+
+    def prepare_batch(self, src_url, src_auth, dst_url, dst_auth, objects):
+        ret = {}
+        ret['upload'] = []
+        ret['download'] = {}
+        ret['missing'] = set()
+        ret['skipped'] = 0
+        ret['status'] = False
+
+        # Ask the target which objects it does not have yet
+        upload_list = self.batch(dst_url, dst_auth, 'upload', objects)
+
+        if not upload_list['status']:
+            self.log.error('Can not get Git LFS upload batch!')
+            return ret
+
+        for obj in upload_list['list']:
+            if 'error' in obj:
+                self.log.error(
+                    'Git LFS object %s can not be uploaded: %s' %
+                    (obj['oid'], obj['error'].get('message')))
+                return ret
+            elif 'actions' in obj and 'upload' in obj['actions']:
+                ret['upload'].append(obj)
+            else:
+                ret['skipped'] += 1
+
+        # Fetch only what is neither on the target nor in the cache
+        fetch_objects = [
+            obj for obj in ret['upload'] if not self.is_cached(obj)]
+
+        if len(fetch_objects) > 0:
+            download_list = self.batch(
+                src_url, src_auth, 'download', fetch_objects)
+
+            if not download_list['status']:
+                self.log.error('Can not get Git LFS download batch!')
+                return ret
+
+            for obj in download_list['list']:
+                if 'error' in obj:
+                    # Pointer committed without the object ever being pushed
+                    self.log.warning(
+                        'Git LFS object %s is not available: %s' %
+                        (obj['oid'], obj['error'].get('message')))
+                    ret['missing'].add(obj['oid'])
+                elif 'actions' in obj and 'download' in obj['actions']:
+                    ret['download'][obj['oid']] = obj
+                else:
+                    self.log.error(
+                        'Git LFS object %s can not be downloaded!' %
+                        obj['oid'])
+                    return ret
+
+        ret['status'] = True
+
+        return ret
+
+    def transfer(self, args):
+        (upload_obj, download_obj, missing,
+            src_url, src_auth, dst_url, dst_auth) = args
+
+        ret = {}
+        ret['missing'] = missing
+        ret['status'] = missing
+
+        if missing:
+            return ret
+
+        if not self.is_cached(upload_obj):
+            if download_obj is None:
+                # Not returned by the source in the download batch
+                self.log.error(
+                    'Git LFS object %s was not downloaded!' %
+                    upload_obj['oid'])
+                return ret
+
+            if not self.retry(download_obj, src_url, src_auth, 'download'):
+                self.log.error(
+                    'Can not download Git LFS object %s!' % upload_obj['oid'])
+                return ret
+
+        # Upload right after the download while the action is still fresh
+        if not self.retry(upload_obj, dst_url, dst_auth, 'upload'):
+            self.log.error(
+                'Can not upload Git LFS object %s!' % upload_obj['oid'])
+            return ret
+
+        ret['status'] = True
+
+        return ret
+
+    def copy_objects(self, src_url, src_auth, dst_url, dst_auth, objects):
+        self.log.debug('Copying Git LFS objects')
+
+        ret = {}
+        ret['uploaded'] = 0
+        ret['skipped'] = 0
+        ret['missing'] = 0
+        ret['status'] = False
+
+        pool = ThreadPool(self.threads)
+
+        try:
+            # Request the batch actions of each chunk just before its objects
+            # are transferred so the actions do not expire meanwhile
+            for i in range(0, len(objects), self.batch_size):
+                prepared = self.prepare_batch(
+                    src_url, src_auth, dst_url, dst_auth,
+                    objects[i:i+self.batch_size])
+
+                if not prepared['status']:
+                    return ret
+
+                ret['skipped'] += prepared['skipped']
+
+                transfers = [
+                    (
+                        obj,
+                        prepared['download'].get(obj['oid']),
+                        obj['oid'] in prepared['missing'],
+                        src_url, src_auth, dst_url, dst_auth)
+                    for obj in prepared['upload']]
+
+                # Each object is downloaded and uploaded by its own task
+                for result in pool.map(self.transfer, transfers, 1):
+                    if not result['status']:
+                        return ret
+                    elif result['missing']:
+                        ret['missing'] += 1
+                    else:
+                        ret['uploaded'] += 1
+        finally:
+            pool.close()
+            pool.join()
+
+        ret['status'] = True
+
+        return ret
+
+
 class Bitbucket2Stash:
     args = None
     config = None
     log = None
+    lfs = None
+    stash = None
+    stash_projects = None
+    mapping_keys = [
+        'bitbucket_prj',
+        'bitbucket_repo',
+        'stash_prj_name',
+        'stash_prj_key',
+        'stash_repo'
+    ]
 
     def __init__(self, args, config, logger):
         self.args = args
         self.config = config
         self.log = logger
 
+        # Clients and inventories reused by all migrated repos
+        self.bitbucket = {}
+        self.bitbucket_repos = {}
+        self.bitbucket_ssh_keys = {}
+        self.stash_repos = {}
+        self.lfs_pointers = {}
+
         self.log.debug('Creating Bitbucket2Stash object instance')
 
-    def check_bitbucket(self):
+    def get_bitbucket(self, project):
         # Create Bitbucket object
-        bb = Bitbucket(
-            self.config.get('bitbucket', 'api_username'),
-            self.config.get('bitbucket', 'api_password'),
-            self.args['<bitbucket_prj>'],
-            self.log)
+        if project not in self.bitbucket:
+            self.bitbucket[project] = Bitbucket(
+                self.config.get('bitbucket', 'api_username'),
+                self.config.get('bitbucket', 'api_password'),
+                project,
+                self.log)
+
+        return self.bitbucket[project]
+
+    def get_stash(self):
+        # Create Stash object
+        if self.stash is None:
+            self.stash = Stash(
+                self.config.get('stash', 'api_username'),
+                self.config.get('stash', 'api_password'),
+                self.config.get('stash', 'api_url'),
+                self.log,
+                self.args['--keys'])
+
+        return self.stash
+
+    def set_mapping(self, mapping):
+        for key in self.mapping_keys:
+            self.args['<%s>' % key] = mapping[key]
+
+    def check_bitbucket(self):
+        project = self.args['<bitbucket_prj>']
 
         # Get list of all Bitbucket repos
-        repo_list = bb.get_repo_list()
+        if project not in self.bitbucket_repos:
+            self.bitbucket_repos[project] = self.get_bitbucket(
+                project).get_repo_list()
+
+        repo_list = self.bitbucket_repos[project]
 
         # Check if Bitbucket project exists
         if not repo_list['status']:
@@ -374,27 +832,22 @@ class Bitbucket2Stash:
             sys.exit(1)
 
     def check_stash(self):
-        # Create Stash object
-        stash = Stash(
-            self.config.get('stash', 'api_username'),
-            self.config.get('stash', 'api_password'),
-            self.config.get('stash', 'api_url'),
-            self.log,
-            self.args['--keys'])
+        stash = self.get_stash()
+        prj_key = self.args['<stash_prj_key>']
 
         # Get list of Stash projects
-        project_list = stash.get_project_list()
+        if self.stash_projects is None:
+            self.stash_projects = stash.get_project_list()
+
+        project_list = self.stash_projects
 
         # Check if the connection was successful
         if not project_list['status']:
             self.log.error('Can not get list of Stash projects!')
             sys.exit(1)
 
-        repo_list = {}
-        repo_list['list'] = []
-
         # Check if the project already exists
-        if self.args['<stash_prj_key>'] not in project_list['keys']:
+        if prj_key not in project_list['keys']:
             self.log.debug(
                 'Stash project "%s" does not exist' %
                 self.args['<stash_prj_key>'])
@@ -407,14 +860,20 @@ class Bitbucket2Stash:
                     'Stash project "%s" was not created!' %
                     self.args['<stash_prj_key>'])
                 sys.exit(1)
-        else:
+
+            project_list['names'].append(self.args['<stash_prj_name>'])
+            project_list['keys'].append(prj_key)
+            self.stash_repos[prj_key] = {'list': [], 'status': True}
+        elif prj_key not in self.stash_repos:
             # Get list of repos from the Stash project
-            repo_list = stash.get_repo_list(self.args['<stash_prj_key>'])
+            self.stash_repos[prj_key] = stash.get_repo_list(prj_key)
 
-            # Check if the connection was successful
-            if not repo_list['status']:
-                self.log.error('Can not get list of Stash repos!')
-                sys.exit(1)
+        repo_list = self.stash_repos[prj_key]
+
+        # Check if the connection was successful
+        if not repo_list['status']:
+            self.log.error('Can not get list of Stash repos!')
+            sys.exit(1)
 
         # Check if the Stash repo exists
         if self.args['<stash_repo>'] not in repo_list['list']:
@@ -429,20 +888,16 @@ class Bitbucket2Stash:
                     self.args['<stash_repo>'])
                 sys.exit(1)
 
-    def copy_repo(self):
-        # Define the temporal repo directory
-        tmp_repo_dir = os.path.join(
-            tempfile.gettempdir(),
-            self.args['<stash_repo>'])
+            repo_list['list'].append(self.args['<stash_repo>'])
 
-        # Delete the local repo if exists
-        if os.path.exists(tmp_repo_dir):
-            self.log.debug('Deleting old local repo')
-            shutil.rmtree(tmp_repo_dir)
+    def clone_repo(self):
+        # Create a unique temporal repo directory so no other directory
+        # (e.g. the Git LFS cache) can be deleted by mistake
+        tmp_repo_dir = tempfile.mkdtemp(prefix='bb2s-repo-')
 
         # Clone Bitbucket repo
         self.log.debug('Cloning Bitbucket repo')
-        cloned_repo = git.Repo.clone_from(
+        git.Repo.clone_from(
             '%sbitbucket.org/%s/%s.git' % (
                 self.config.get('bitbucket', 'git_protocol'),
                 self.args['<bitbucket_prj>'],
@@ -452,10 +907,15 @@ class Bitbucket2Stash:
             bare=True
         )
 
+        return git.Repo(tmp_repo_dir)
+
+    def push_repo(self, tmp_repo):
         # Push repo to Stash
         self.log.debug('Pushing repo to Stash')
-        tmp_repo = git.Repo(tmp_repo_dir)
-        tmp_repo.delete_remote('origin')
+
+        if 'origin' in [remote.name for remote in tmp_repo.remotes]:
+            tmp_repo.delete_remote('origin')
+
         tmp_repo_origin = tmp_repo.create_remote(
             'origin', url='%s/%s/%s.git' % (
                 self.config.get('stash', 'git_url'),
@@ -465,20 +925,282 @@ class Bitbucket2Stash:
         )
         tmp_repo_origin.push(mirror=True)
 
+        # Copy LFS objects referenced from any ref of the repo
+        if self.args['--lfs']:
+            self.copy_lfs_objects(tmp_repo)
+
+    def delete_repo(self, tmp_repo):
         # Delete the local temporal repo
         self.log.debug('Deleting local temporal repo')
-        shutil.rmtree(tmp_repo_dir)
+        shutil.rmtree(tmp_repo.git_dir)
 
-    def copy_ssh_keys(self):
-        # Create Bitbucket object
-        bb = Bitbucket(
-            self.config.get('bitbucket', 'api_username'),
-            self.config.get('bitbucket', 'api_password'),
+    def copy_repo(self):
+        tmp_repo = self.clone_repo()
+        self.push_repo(tmp_repo)
+        self.delete_repo(tmp_repo)
+
+    def log_migration(self):
+        self.log.info('Migrating Bitbucket{%s/%s} ~> Stash{%s(%s)/%s}' % (
             self.args['<bitbucket_prj>'],
-            self.log)
+            self.args['<bitbucket_repo>'],
+            self.args['<stash_prj_name>'],
+            self.args['<stash_prj_key>'],
+            self.args['<stash_repo>']
+        ))
 
-        # Get list of all Bitbucket repos
-        bb_ssh_keys_list = bb.get_repo_ssh_keys(self.args['<bitbucket_repo>'])
+    def migrate(self):
+        self.log_migration()
+        self.check_bitbucket()
+        self.check_stash()
+        self.copy_repo()
+
+        if self.args['--keys']:
+            self.copy_ssh_keys()
+
+    def read_manifest(self):
+        self.log.debug('Reading manifest file')
+
+        path = self.args['--manifest']
+
+        if path.lower().endswith(('.yml', '.yaml')) and yaml is None:
+            self.log.error('PyYAML is required to read YAML manifests!')
+            sys.exit(1)
+
+        try:
+            if path.lower().endswith(('.yml', '.yaml')):
+                with open(path) as f:
+                    try:
+                        entries = yaml.safe_load(f)
+                    except yaml.YAMLError as e:
+                        self.log.error('Can not parse manifest file: %s' % e)
+                        sys.exit(1)
+            else:
+                with open(path, 'rb') as f:
+                    reader = csv.DictReader(f)
+
+                    # Spreadsheet exports often start with the UTF-8 BOM
+                    if (reader.fieldnames and
+                            reader.fieldnames[0].startswith(
+                                codecs.BOM_UTF8)):
+                        reader.fieldnames[0] = reader.fieldnames[0][
+                            len(codecs.BOM_UTF8):]
+
+                    entries = list(reader)
+        except (IOError, csv.Error) as e:
+            self.log.error('Can not read manifest file: %s' % e)
+            sys.exit(1)
+
+        if entries is None:
+            entries = []
+        elif not isinstance(entries, list):
+            self.log.error('Manifest must be a list of repo mappings!')
+            sys.exit(1)
+
+        mappings = []
+
+        for n, entry in enumerate(entries, 1):
+            if not isinstance(entry, dict):
+                self.log.error('Manifest entry %d is not a mapping!' % n)
+                sys.exit(1)
+
+            mapping = {}
+
+            for key in self.mapping_keys:
+                value = entry.get(key)
+
+                # Keep all values as unicode whatever the manifest format
+                if isinstance(value, str):
+                    value = value.decode('utf-8').strip()
+                elif isinstance(value, basestring):
+                    value = value.strip()
+                elif value is not None:
+                    value = unicode(value)
+
+                mapping[key] = value or None
+
+            # Default Stash repo name
+            if mapping['stash_repo'] is None:
+                mapping['stash_repo'] = mapping['bitbucket_repo']
+
+            for key in self.mapping_keys:
+                if mapping[key] is None:
+                    self.log.error(
+                        'Manifest entry %d is missing "%s"!' % (n, key))
+                    sys.exit(1)
+
+            # Make the Stash project key lowercase
+            mapping['stash_prj_key'] = mapping['stash_prj_key'].lower()
+
+            mappings.append(mapping)
+
+        return mappings
+
+    def migrate_manifest(self):
+        sources = []
+        targets = {}
+        target_sources = {}
+        project_names = {}
+
+        # Group targets by source so each repo is cloned only once
+        for mapping in self.read_manifest():
+            source = (mapping['bitbucket_prj'], mapping['bitbucket_repo'])
+            target = (mapping['stash_prj_key'], mapping['stash_repo'])
+
+            if target in target_sources:
+                if target_sources[target] == source:
+                    self.log.warning(
+                        'Skipping duplicate mapping of Stash repo "%s/%s"' %
+                        target)
+                    continue
+
+                self.log.error(
+                    'Stash repo "%s/%s" is mapped from more Bitbucket repos!' %
+                    target)
+                sys.exit(1)
+
+            prj_key = mapping['stash_prj_key']
+
+            if prj_key not in project_names:
+                project_names[prj_key] = mapping['stash_prj_name']
+            elif project_names[prj_key] != mapping['stash_prj_name']:
+                self.log.error(
+                    'Stash project "%s" is mapped with more names!' % prj_key)
+                sys.exit(1)
+
+            target_sources[target] = source
+
+            if source not in targets:
+                sources.append(source)
+                targets[source] = []
+
+            targets[source].append(mapping)
+
+        self.log.info(
+            'Migrating %d Bitbucket repos into %d Stash repos' %
+            (len(sources), len(target_sources)))
+
+        # Check all sources before anything is migrated
+        for source in sources:
+            self.set_mapping(targets[source][0])
+            self.check_bitbucket()
+
+        for source in sources:
+            self.set_mapping(targets[source][0])
+            tmp_repo = self.clone_repo()
+
+            for mapping in targets[source]:
+                self.set_mapping(mapping)
+                self.log_migration()
+                self.check_stash()
+                self.push_repo(tmp_repo)
+
+                if self.args['--keys']:
+                    self.copy_ssh_keys()
+
+            self.delete_repo(tmp_repo)
+
+    def get_lfs(self):
+        # Create GitLfs object shared by all repos so the cache is reused
+        if self.lfs is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), 'bb2s-lfs')
+            threads = 4
+            batch_size = 100
+
+            if self.config.has_option('lfs', 'cache_dir'):
+                cache_dir = self.config.get('lfs', 'cache_dir')
+
+            if self.config.has_option('lfs', 'threads'):
+                threads = self.config.getint('lfs', 'threads')
+
+            if self.config.has_option('lfs', 'batch_size'):
+                batch_size = self.config.getint('lfs', 'batch_size')
+
+            self.lfs = GitLfs(cache_dir, self.log, threads, batch_size)
+
+        return self.lfs
+
+    def get_lfs_urls(self):
+        bitbucket_url = 'https://bitbucket.org'
+        stash_url = self.config.get('stash', 'git_url')
+
+        if self.config.has_option('lfs', 'bitbucket_url'):
+            bitbucket_url = self.config.get('lfs', 'bitbucket_url')
+
+        if self.config.has_option('lfs', 'stash_url'):
+            stash_url = self.config.get('lfs', 'stash_url')
+
+        # The LFS API is available over HTTP(S) only
+        if not stash_url.startswith(('http://', 'https://')):
+            self.log.error(
+                'Stash Git LFS URL must be HTTP(S), set "stash_url" in the '
+                '[lfs] section!')
+            sys.exit(1)
+
+        return (
+            '%s/%s/%s.git/info/lfs' % (
+                bitbucket_url,
+                self.args['<bitbucket_prj>'],
+                self.args['<bitbucket_repo>']),
+            '%s/%s/%s.git/info/lfs' % (
+                stash_url,
+                self.args['<stash_prj_key>'],
+                self.args['<stash_repo>']))
+
+    def copy_lfs_objects(self, repo):
+        lfs = self.get_lfs()
+
+        source = (self.args['<bitbucket_prj>'], self.args['<bitbucket_repo>'])
+
+        # Get list of all LFS pointers
+        if source not in self.lfs_pointers:
+            self.lfs_pointers[source] = lfs.get_pointer_list(repo)
+
+        pointer_list = self.lfs_pointers[source]
+
+        # No objects to copy over
+        if len(pointer_list['list']) == 0:
+            return
+
+        src_url, dst_url = self.get_lfs_urls()
+
+        self.log.info(
+            'Copying %d Git LFS objects' % len(pointer_list['list']))
+
+        result = lfs.copy_objects(
+            src_url,
+            (
+                self.config.get('bitbucket', 'api_username'),
+                self.config.get('bitbucket', 'api_password')),
+            dst_url,
+            (
+                self.config.get('stash', 'api_username'),
+                self.config.get('stash', 'api_password')),
+            pointer_list['list'])
+
+        if not result['status']:
+            self.log.error('Can not copy Git LFS objects!')
+            sys.exit(1)
+
+        msg = (
+            'Git LFS objects uploaded: %d, already present: %d, missing: %d' %
+            (result['uploaded'], result['skipped'], result['missing']))
+
+        # Missing objects leave dangling pointers in the Stash repo
+        if result['missing'] > 0:
+            self.log.warning(msg)
+        else:
+            self.log.info(msg)
+
+    def copy_ssh_keys(self):
+        source = (self.args['<bitbucket_prj>'], self.args['<bitbucket_repo>'])
+
+        # Get list of all Bitbucket repo SSH keys
+        if source not in self.bitbucket_ssh_keys:
+            self.bitbucket_ssh_keys[source] = self.get_bitbucket(
+                self.args['<bitbucket_prj>']).get_repo_ssh_keys(
+                    self.args['<bitbucket_repo>'])
+
+        bb_ssh_keys_list = self.bitbucket_ssh_keys[source]
 
         # Check if the connection was successful
         if not bb_ssh_keys_list['status']:
@@ -489,15 +1211,9 @@ class Bitbucket2Stash:
         if len(bb_ssh_keys_list['list']) == 0:
             return
 
-        # Create Stash object
-        stash = Stash(
-            self.config.get('stash', 'api_username'),
-            self.config.get('stash', 'api_password'),
-            self.config.get('stash', 'api_url'),
-            self.log,
-            self.args['--keys'])
+        stash = self.get_stash()
 
-        # Get list of Stash projects
+        # Get list of Stash repo SSH keys
         stash_ssh_keys_list = stash.get_repo_ssh_keys(
             self.args['<stash_prj_key>'],
             self.args['<stash_repo>'])
@@ -658,21 +1374,10 @@ def main():
         bb2s.list_stash_projects()
     elif args['list'] and args['stash'] and args['repos']:
         bb2s.list_stash_repos()
+    elif args['migrate']:
+        bb2s.migrate_manifest()
     else:
-        log.info('Migrating Bitbucket{%s/%s} ~> Stash{%s(%s)/%s}' % (
-            args['<bitbucket_prj>'],
-            args['<bitbucket_repo>'],
-            args['<stash_prj_name>'],
-            args['<stash_prj_key>'],
-            args['<stash_repo>']
-        ))
-
-        bb2s.check_bitbucket()
-        bb2s.check_stash()
-        bb2s.copy_repo()
-
-        if args['--keys']:
-            bb2s.copy_ssh_keys()
+        bb2s.migrate()
 
 
 if __name__ == '__main__':